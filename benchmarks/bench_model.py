@@ -0,0 +1,180 @@
+"""
+Benchmark of fitting, predicting and evaluating a recommender.
+
+Times `LaboRecommender.fit`, batch `predict`, single bag `recommend_one`,
+`validation.mean_average_f_1`, `partial_fit` with batches of several sizes and
+`validation.grid_search` on synthetic bags
+from `synthetic.make_bags`, and measures the peak memory traced during each
+stage. Results are printed and written as JSON, tagged with the current git
+commit, so runs of different commits can be compared with `compare.py`.
+
+Usage::
+
+    python benchmarks/bench_model.py --bags 1000000 --algorithm inverted minhash
+    python benchmarks/compare.py results/old.json results/new.json
+
+The script runs from any directory and imports the `laborecommender`
+package of the checkout it belongs to, without installing it.
+
+Each stage is timed `--repeat` times and then run once more under
+`tracemalloc` to measure its peak memory, which does not slow down the
+timed runs.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import laborecommender.data # pylint: disable=wrong-import-position
+import laborecommender.model
+import laborecommender.validation
+from synthetic import make_bags
+
+def git_commit() -> str:
+    """
+    Returns the current git commit of the repository, None outside of git.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(name: str, function, repeat: int, **info) -> dict:
+    """
+    Times a function and measures its peak traced memory.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    function : callable
+        Function without arguments running the stage.
+    repeat : int
+        Number of timed runs.
+    **info
+        Extra fields of the result.
+
+    Returns
+    -------
+    dict
+        Result of the stage, with the minimum and median times in seconds and
+        the peak memory in bytes.
+
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {"name": name, "min_s": min(times), "median_s": statistics.median(times), "peak_bytes": peak, **info}
+    print(f"{name:<40} {result['min_s']:>10.4f} s {peak / 2**20:>10.1f} MiB", flush=True)
+    return result
+
+def bench_algorithm(algorithm: str, train: list, test_x, test_y, args) -> list:
+    """
+    Runs the fit, predict and metric stages for an algorithm.
+    """
+    results = []
+    recommender = laborecommender.model.LaboRecommender(k=args.k, algorithm=algorithm, sparse=True, random_state=0, min_support=args.min_support)
+    results.append(measure(f"{algorithm}.fit", lambda: recommender.fit(train), args.repeat, n_bags=len(train)))
+    results[-1]["n_unique_bags"] = len(recommender.counts_)
+    predicted = recommender.predict(test_x, n=args.n)
+    results.append(measure(f"{algorithm}.predict", lambda: recommender.predict(test_x, n=args.n), args.repeat, n_queries=len(test_x)))
+    single = list(test_x[:args.single])
+    latencies = []
+    def recommend_each():
+        latencies.clear()
+        for bag in single:
+            start = time.perf_counter()
+            recommender.recommend_one(bag, n=args.n)
+            latencies.append(time.perf_counter() - start)
+    results.append(measure(f"{algorithm}.recommend_one", recommend_each, args.repeat, n_queries=len(single)))
+    results[-1]["p50_s"], results[-1]["p99_s"] = np.percentile(latencies, [50, 99]).tolist()
+    results.append(measure(f"{algorithm}.mean_average_f_1", lambda: laborecommender.validation.mean_average_f_1(test_y, predicted), args.repeat, n_queries=len(test_x)))
+    results[-1]["score"] = laborecommender.validation.mean_average_f_1(test_y, predicted)
+    # the first call hashes the indexed bags, later ones only depend on the batch
+    recommender.partial_fit(train[:1])
+    for size in args.partial_batches:
+        new = make_bags(size * (args.repeat + 1), args.tests, seed=args.seed + size)
+        batches = (new[start:start + size] for start in range(0, len(new), size))
+        results.append(measure(f"{algorithm}.partial_fit.{size}", lambda: recommender.partial_fit(next(batches)), args.repeat, n_bags=size))
+        results[-1]["n_unique_bags"] = len(recommender.counts_)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bags", type=int, default=10**5, help="number of synthetic training bags, from 10^4 to 10^7")
+    parser.add_argument("--tests", type=int, default=700, help="number of different tests")
+    parser.add_argument("--queries", type=int, default=10**4, help="number of cut bags predicted in batch")
+    parser.add_argument("--single", type=int, default=1000, help="number of cut bags predicted one at a time")
+    parser.add_argument("--algorithm", nargs="+", default=["inverted", "minhash"], help="nearest neighbors algorithms")
+    parser.add_argument("--k", type=int, default=10, help="number of neighbors")
+    parser.add_argument("--n", type=int, default=5, help="number of recommended tests")
+    parser.add_argument("--min-support", type=int, default=None, help="support of the precomputed sub-bags, none are precomputed by default")
+    parser.add_argument("--partial-batches", type=int, nargs="*", default=[10**3, 10**4], help="sizes of the batches appended by partial_fit, none to skip it")
+    parser.add_argument("--grid-bags", type=int, default=10**4, help="number of bags of the grid search, 0 to skip it")
+    parser.add_argument("--n-jobs", type=int, default=None, help="number of worker processes of the grid search")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs of each stage")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic bags")
+    parser.add_argument("--output", default=None, help="JSON file of the results, in benchmarks/results/ by default")
+    args = parser.parse_args()
+
+    bags = make_bags(args.bags + args.queries, args.tests, seed=args.seed)
+    train, test = bags[:args.bags], bags[args.bags:]
+    test_x, test_y = laborecommender.data.cut_bags(test)
+    test_x, test_y = test_x[:args.queries], test_y[:args.queries]
+    results = []
+    for algorithm in args.algorithm:
+        results.extend(bench_algorithm(algorithm, train, test_x, test_y, args))
+    if args.grid_bags:
+        grid = {"k": [5, 10, 20], "algorithm": args.algorithm}
+        results.append(measure(
+            "grid_search",
+            lambda: laborecommender.validation.grid_search(
+                grid, laborecommender.model.LaboRecommender(sparse=True, random_state=0), train[:args.grid_bags],
+                laborecommender.validation.mean_average_f_1, n=args.n, cv=3, n_jobs=args.n_jobs
+            ),
+            args.repeat,
+            n_bags=min(args.grid_bags, len(train)),
+            grid=grid
+        ))
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "args": vars(args),
+        "results": results
+    }
+    output = args.output
+    if output is None:
+        name = f"{(commit or 'local')[:10]}-{datetime.datetime.now():%Y%m%d%H%M%S}.json"
+        output = os.path.join(os.path.dirname(os.path.realpath(__file__)), "results", name)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
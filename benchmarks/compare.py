@@ -0,0 +1,35 @@
+"""
+Comparison of two benchmark results.
+
+Prints the time and peak memory of each stage found in both results of
+`bench_model.py`, and their ratio from the first to the second.
+
+Usage::
+
+    python benchmarks/compare.py results/old.json results/new.json
+"""
+import argparse
+import json
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("base", help="JSON results of the reference run")
+    parser.add_argument("new", help="JSON results of the compared run")
+    args = parser.parse_args()
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{'stage':<40} {'base s':>10} {'new s':>10} {'ratio':>7} {'base MiB':>10} {'new MiB':>10} {'ratio':>7}")
+    new_results = {result["name"]: result for result in new["results"]}
+    for result in base["results"]:
+        other = new_results.get(result["name"])
+        if other is None:
+            continue
+        print(
+            f"{result['name']:<40} {result['min_s']:>10.4f} {other['min_s']:>10.4f} {other['min_s'] / result['min_s']:>7.2f}"
+            f" {result['peak_bytes'] / 2**20:>10.1f} {other['peak_bytes'] / 2**20:>10.1f} {other['peak_bytes'] / max(result['peak_bytes'], 1):>7.2f}"
+        )
+
+if __name__ == "__main__":
+    main()
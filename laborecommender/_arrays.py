@@ -0,0 +1,113 @@
+import numpy as np
+
+def ragged_positions(lengths: np.ndarray) -> np.ndarray:
+    """
+    Computes the position of each item within its segment.
+
+    Parameters
+    ----------
+    lengths : array of int
+        Number of items of each segment, segments are one after the other.
+
+    Returns
+    -------
+    array of shape (`lengths.sum()`,)
+        Position of each item in its segment, from 0.
+
+    Examples
+    --------
+    >>> import laborecommender._arrays
+    >>> import numpy as np
+    >>> laborecommender._arrays.ragged_positions(np.array([2, 0, 3]))
+    array([0, 1, 0, 1, 2])
+
+    """
+    lengths = np.asarray(lengths)
+    return np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+def ragged_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Concatenates the ranges `starts[i]:starts[i] + lengths[i]`.
+
+    Indexing a flat array with the result gathers several of its slices at
+    once, such as the rows of a CSR matrix from its `indptr`.
+
+    Parameters
+    ----------
+    starts : array of int
+        Start of each range.
+    lengths : array of int
+        Length of each range.
+
+    Returns
+    -------
+    array of shape (`lengths.sum()`,)
+        Indices of every range one after the other.
+
+    Examples
+    --------
+    >>> import laborecommender._arrays
+    >>> import numpy as np
+    >>> laborecommender._arrays.ragged_ranges(np.array([5, 0]), np.array([2, 3]))
+    array([5, 6, 0, 1, 2])
+
+    """
+    lengths = np.asarray(lengths)
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+def append(array: np.ndarray, values: np.ndarray, axis: int = 0) -> np.ndarray:
+    """
+    Appends values to an array with amortized growth.
+
+    The result is a view of the start of a buffer with room for at least as
+    many items again, so appending to it again only writes `values` until
+    the buffer is full. Only the last view returned for a buffer may be
+    appended to, appending to an earlier one overwrites the items of the
+    later ones. Arrays that are not such views, such as read-only memory
+    maps, are copied into a new buffer.
+
+    Parameters
+    ----------
+    array : array
+        Array to append to.
+    values : array
+        Values to append, with the shape of `array` except along `axis`.
+    axis : int, default=0
+        Axis to append along.
+
+    Returns
+    -------
+    array
+        View of the concatenation of `array` and `values` along `axis`.
+
+    Examples
+    --------
+    >>> import laborecommender._arrays
+    >>> import numpy as np
+    >>> a = laborecommender._arrays.append(np.arange(3), np.arange(2))
+    >>> b = laborecommender._arrays.append(a, np.array([7]))
+    >>> b, b.base is a.base
+    (array([0, 1, 2, 0, 1, 7]), True)
+
+    """
+    values = np.asarray(values, dtype=array.dtype)
+    n, m = array.shape[axis], values.shape[axis]
+    base = array.base
+    index = [slice(None)] * array.ndim
+    if (
+        type(base) is np.ndarray and base.flags.writeable and base.dtype == array.dtype
+        and base.strides == array.strides and base.shape[axis] >= n + m
+        and base.shape[:axis] + base.shape[axis + 1:] == array.shape[:axis] + array.shape[axis + 1:]
+        and base.__array_interface__["data"][0] == array.__array_interface__["data"][0]
+    ):
+        buffer = base
+    else:
+        shape = list(array.shape)
+        shape[axis] = max(n + m, 2 * n)
+        buffer = np.empty(shape, dtype=array.dtype)
+        index[axis] = slice(0, n)
+        buffer[tuple(index)] = array
+    index[axis] = slice(n, n + m)
+    buffer[tuple(index)] = values
+    index[axis] = slice(0, n + m)
+    return buffer[tuple(index)]
@@ -0,0 +1,66 @@
+import os
+import multiprocessing
+import concurrent.futures
+
+def effective_n_jobs(n_jobs: int = None) -> int:
+    """
+    Computes the number of worker processes to use.
+
+    Parameters
+    ----------
+    n_jobs : int, default=None
+        Requested number of jobs, None means 1 and -1 means using all processors.
+
+    Returns
+    -------
+    int
+        Number of worker processes.
+
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return n_jobs
+
+_worker_state = None
+
+def _init_worker(state):
+    global _worker_state # pylint: disable=global-statement
+    _worker_state = state
+
+def worker_state():
+    """
+    Gets the state of the current worker process.
+
+    Returns
+    -------
+    object
+        The `state` passed to the `process_pool` that started the worker.
+
+    """
+    return _worker_state
+
+def process_pool(n_jobs: int, state=None) -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Creates a pool of worker processes forked from the current process.
+
+    Workers are forked when the platform allows it, so large read-only objects
+    passed in `state` are shared copy-on-write instead of pickled. Functions
+    run by the workers read it with `worker_state`.
+
+    Parameters
+    ----------
+    n_jobs : int
+        Number of worker processes.
+    state : object, default=None
+        State of the workers.
+
+    Returns
+    -------
+    concurrent.futures.ProcessPoolExecutor
+        The pool of worker processes.
+
+    """
+    mp_context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    return concurrent.futures.ProcessPoolExecutor(n_jobs, mp_context=mp_context, initializer=_init_worker, initargs=(state,))
@@ -0,0 +1,124 @@
+import collections
+import threading
+import time
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+class LRUCache():
+    """
+    Bounded least recently used cache with optional expiration.
+
+    Keeps at most `maxsize` entries, evicting the least recently used one when
+    full. Entries older than `ttl` seconds are treated as missing. Lookups and
+    insertions are thread safe.
+
+    Parameters
+    ----------
+    maxsize : int, default=1024
+        Maximum number of entries.
+    ttl : float, default=None
+        Time to live of an entry in seconds, entries never expire if None.
+
+    Attributes
+    ----------
+    hits : int
+        Number of lookups that found a valid entry.
+    misses : int
+        Number of lookups that did not find a valid entry.
+
+    Examples
+    --------
+    >>> import laborecommender.cache
+    >>> cache = laborecommender.cache.LRUCache(maxsize=2)
+    >>> cache.put("a", 1)
+    >>> cache.get("a"), cache.get("b")
+    (1, None)
+    >>> cache.info()
+    CacheInfo(hits=1, misses=1, maxsize=2, currsize=1)
+
+    """
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Looks up a key and marks it as the most recently used.
+
+        Parameters
+        ----------
+        key : hashable
+            Key to look up.
+        default : object, default=None
+            Value returned when the key is missing or expired.
+
+        Returns
+        -------
+        object
+            Cached value or `default`.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entry if full.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the value.
+        value : object
+            Value to store.
+
+        """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all the entries and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> CacheInfo:
+        """
+        Reports the cache statistics.
+
+        Returns
+        -------
+        CacheInfo
+            Named tuple of hits, misses, maxsize and currsize.
+
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
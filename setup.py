@@ -13,6 +13,7 @@ setup(
   install_requires=[            # I get to this in a second
           "pandas",
           "numpy",
+          "scipy",
           "sklearn"
       ],
   classifiers=[
@@ -1,15 +1,12 @@
+import laborecommender.data
 import laborecommender.model
-import json
 import os
 
 project_dir= os.path.dirname(os.path.realpath(__file__))
 
-with open(os.path.join(project_dir,"data/interim/train_bags.json")) as j:
-    train_bags = json.load(j)
-with open(os.path.join(project_dir,"data/interim/test_bags_x.json")) as j:
-    test_bags_x = json.load(j)
-with open(os.path.join(project_dir,"data/interim/test_bags_y.json")) as j:
-    test_bags_y = json.load(j)
+train_bags = laborecommender.data.read_bags(os.path.join(project_dir,"data/interim/train_bags"))
+test_bags = laborecommender.data.read_bags(os.path.join(project_dir,"data/interim/test_bags"))
+test_bags_x, test_bags_y = laborecommender.data.cut_bags(test_bags)
 
 labo_recommender = laborecommender.model.LaboRecommender()
 labo_recommender.fit(train_bags)